@@ -17,6 +17,7 @@
 # # ATLAS Open Data $H\rightarrow ZZ^\star$ with `ServiceX`, `coffea`, `cabinetry` & `pyhf`
 
 # %%
+from concurrent.futures import ThreadPoolExecutor
 import re
 import time
 
@@ -29,7 +30,8 @@ import mplhep
 import numpy as np
 import pyhf
 import uproot
-from servicex import ServiceXDataset
+from servicex import ServiceXAdaptor, ServiceXDataset
+from servicex.servicex_config import ServiceXConfigAdaptor
 
 from coffea import processor
 from coffea.nanoevents.schemas.base import BaseSchema
@@ -197,17 +199,31 @@ dummy_ds.return_qastle = True
 lepton_query = get_lepton_query(dummy_ds)
 query = lepton_query.value()
 
+# read the ServiceX configuration once and share a single authenticated adaptor between all datasets,
+# so that the access token is only requested once instead of once per dataset
+servicex_config = ServiceXConfigAdaptor()
+servicex_adaptor = ServiceXAdaptor(*servicex_config.get_servicex_adaptor_config("uproot"))
+
 # now we query the files and create a fileset dictionary containing the
 # URLs pointing to the queried files
 
+def deliver(ds_name: str) -> list:
+    """Submits the query for one dataset to ServiceX and returns the delivered files."""
+    ds = ServiceXDataset(input_files[ds_name], backend_name="uproot", servicex_adaptor=servicex_adaptor,
+                         config_adaptor=servicex_config, ignore_cache=IGNORE_CACHE)
+    return ds.get_data_rootfiles_uri(query, as_signed_url=True, title=ds_name)
+
+
 t0 = time.time()
 
-fileset = {}
+# submit all transforms at once, so that they run concurrently on the ServiceX side
+# (total delivery time is given by the slowest dataset instead of the sum over all datasets)
+with ThreadPoolExecutor(max_workers=len(input_files)) as pool:
+    files_per_dataset = dict(zip(input_files.keys(), pool.map(deliver, input_files.keys())))
 
-for ds_name in input_files.keys():
-    ds = ServiceXDataset(input_files[ds_name], backend_name="uproot", ignore_cache=IGNORE_CACHE)
-    files = ds.get_data_rootfiles_uri(query, as_signed_url=True, title=ds_name)
+fileset = {}
 
+for ds_name, files in files_per_dataset.items():
     fileset[ds_name] = {"files": [f.url for f in files],
                         "metadata": {"dataset_name": ds_name}
                        }
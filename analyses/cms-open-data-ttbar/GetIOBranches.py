@@ -1,46 +1,132 @@
+import functools
+import hashlib
+import ijson
 import json
+import os
+from pathlib import Path
+
+import numba
 import numpy as np
+import orjson
 
 ### OPTIONS
 ratio_json_path = "nanoaod_branch_ratios.json"
+# optionally also write the resulting branch lists to this JSON file
+output_json_path = None
+# parsed and sorted ratios are cached here, keyed by the hash of the ratio file
+cache_dir = ".cache"
 agc_original_branches = ["Jet_pt", "Jet_eta", "Jet_phi", "Jet_btagCSVV2", "Jet_mass", 
                          "Muon_pt", "Electron_pt"]
-desired_percents = [15,25,50]
+# hashed lookup for membership tests, the list above keeps the output order
+agc_original_branch_set = frozenset(agc_original_branches)
+desired_percents = (15, 25, 50)
 
 
-def main():
-    
-    with open(ratio_json_path) as json_file:
-        branch_ratios = json.load(json_file)
-    
-    io_branch_dict = {}
+def hash_ratio_file():
+    # hash in blocks, the ratio file is never held in memory as a whole
+    ratios_hash = hashlib.sha1()
+    with open(ratio_json_path, "rb") as json_file:
+        for block in iter(lambda: json_file.read(1 << 20), b""):
+            ratios_hash.update(block)
+    return ratios_hash.hexdigest()
+
+
+def load_sorted_ratios(ratios_hash, max_percent):
+    # returns branch names (in file order), the order sorting the ones which can be selected
+    # for targets up to max_percent by size, their percentages sorted in ascending order and
+    # the percentage associated with the original AGC branches
+    cache_path = Path(cache_dir) / f"ratios-{ratios_hash}-{max_percent}.npz"
+    if cache_path.exists():
+        # ratio file has not changed since the last run: skip parsing and sorting
+        with np.load(cache_path) as cached:
+            return cached["keys"].tolist(), cached["order"], cached["values"], float(cached["agc_sum"])
+
+    # stream the ratios instead of holding the full file and its parsed dict in memory:
+    # collect keys and values, and calculate percentage associated with original AGC branches
+    keys = []
+    values_list = []
+    agc_sum = 0
+    with open(ratio_json_path, "rb") as json_file:
+        for key, value in ijson.kvitems(json_file, "", use_float=True):
+            keys.append(key)
+            values_list.append(value)
+            if key in agc_original_branch_set:
+                agc_sum+=value
+
+    values = np.asarray(values_list, dtype=np.float64)
+
+    # branches overshooting the largest target by more than 2% are never selected,
+    # so only the remaining candidates need to be sorted
+    candidates = np.flatnonzero(100*values <= 1.02*max_percent)
+    # only the sort order is kept for the names, they are gathered once the selection is done
+    order = candidates[np.argsort(values[candidates], kind="stable")]
+    # work in percent throughout
+    values = 100*values[order]
+    agc_sum = 100*agc_sum
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, keys=keys, order=order, values=values, agc_sum=agc_sum)
+
+    return keys, order, values, agc_sum
+
 
-    # calculate percentage associated with original AGC branches
-    current_sum = 0
-    for key in branch_ratios.keys():
-        if key in agc_original_branches:
-            current_sum+=branch_ratios[key]
-    io_branch_dict[np.round(100*current_sum,1)] = agc_original_branches
+@numba.njit(cache=True)
+def select_branches(values, percent):
+    # walk down from the largest branch (values sorted in ascending order), skipping branches
+    # that overshoot the remaining percentage by more than 2%
+    # returns positions of the selected branches, the percentage they add up to and
+    # whether the target percentage was reached
+    selected = np.empty(len(values), dtype=np.int64)
+    n_selected = 0
+    current_sum = 0.0
+    for i in range(len(values) - 1, -1, -1):
+        if values[i] > 1.02*(percent-current_sum):
+            continue
+        if current_sum+values[i] >= percent:
+            return selected[:n_selected], current_sum, True
+        selected[n_selected] = i
+        n_selected += 1
+        current_sum += values[i]
+    return selected[:n_selected], current_sum, False
 
-    sortind = np.flip(np.argsort(list(branch_ratios.values())))
-    keys = np.array(list(branch_ratios.keys()))[sortind]
-    values = np.array(list(branch_ratios.values()))[sortind]
 
+@functools.lru_cache(maxsize=8)
+def compute_io_branches(ratios_hash, desired_percents):
+    # ratios_hash ties cached results to the content of the ratio file,
+    # desired_percents needs to be a tuple to be hashable
+    keys, order, values, agc_sum = load_sorted_ratios(ratios_hash, max(desired_percents))
+
+    io_branch_dict = {}
+    io_branch_dict[round(agc_sum, 1)] = agc_original_branches
+
+    reports = []
     for percent in desired_percents:
-        branch_names = []
-        current_sum = 0
-        for i, key in enumerate(keys):
-            if 100*values[i] > 1.02*(percent-100*current_sum):
-                continue
-            if 100*(current_sum+values[i])>=percent:
-                print(f"Expected Percentage = {percent}, Calculated Percentage = {100*np.round(current_sum,4)}, Number of Branches = {len(branch_names)}")
-                break
-            branch_names.append(key)
-            current_sum+=values[i]
-        io_branch_dict[percent] = branch_names
+        selected, current_sum, reached = select_branches(values, float(percent))
+        if reached:
+            reports.append((percent, current_sum, len(selected)))
+        io_branch_dict[percent] = [keys[i] for i in order[selected].tolist()]
+
+    return io_branch_dict, reports
+
+
+def main():
+
+    io_branch_dict, reports = compute_io_branches(hash_ratio_file(), tuple(desired_percents))
+
+    for percent, current_sum, n_branches in reports:
+        print(f"Expected Percentage = {percent}, Calculated Percentage = {round(current_sum, 2)}, Number of Branches = {n_branches}")
 
     print(json.dumps(io_branch_dict, sort_keys=True, indent=4))
 
+    if output_json_path is not None:
+        # serialize once and hand the whole payload to a single write call, then move
+        # the file into place atomically so an interrupted run cannot leave a partial file
+        payload = orjson.dumps(io_branch_dict, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        tmp_path = f"{output_json_path}.tmp"
+        with open(tmp_path, "wb") as outfile:
+            outfile.write(payload)
+        os.replace(tmp_path, output_json_path)
+
 
 if __name__ == "__main__":
     main()
@@ -55,7 +55,6 @@ import copy
 import hist
 import matplotlib.pyplot as plt
 import numpy as np
-import pyhf
 
 import utils  # contains code for bookkeeping and cosmetics, as well as some boilerplate
 
@@ -118,6 +117,11 @@ USE_TRITON = False
 # During the processing step, machine learning is used to calculate one of the variables used for this analysis. The models used are trained separately in the `jetassignment_training.ipynb` notebook. Jets in the events are assigned to labels corresponding with their parent partons using a boosted decision tree (BDT). More information about the model and training can be found within that notebook.
 
 # %%
+# constants used in the processor, defined once instead of in every call of `process`
+LUMI = 3378  # /pb
+B_TAG_THRESHOLD = 0.5
+
+
 class TtbarAnalysis(processor.ProcessorABC):
     def __init__(self, use_inference, use_triton):
 
@@ -137,6 +141,13 @@ class TtbarAnalysis(processor.ProcessorABC):
         
         self.cset = correctionlib.CorrectionSet.from_file("corrections.json")
         self.use_inference = use_inference
+
+        # benchmarking settings are fixed for the whole run, resolve them once instead of per chunk
+        self.disable_processing = utils.config["benchmarking"]["DISABLE_PROCESSING"]
+        # (the IO branch list is only looked up when it is used, for IO testing)
+        self.io_branches = None
+        if self.disable_processing:
+            self.io_branches = utils.config["benchmarking"]["IO_BRANCHES"][utils.config["benchmarking"]["IO_FILE_PERCENT"]]
         
         # set up attributes only needed if USE_INFERENCE=True
         if self.use_inference:
@@ -158,9 +169,7 @@ class TtbarAnalysis(processor.ProcessorABC):
             self.use_triton = use_triton
 
     def only_do_IO(self, events):
-        for branch in utils.config["benchmarking"]["IO_BRANCHES"][
-            utils.config["benchmarking"]["IO_FILE_PERCENT"]
-        ]:
+        for branch in self.io_branches:
             if "_" in branch:
                 split = branch.split("_")
                 object_type = split[0]
@@ -171,7 +180,7 @@ class TtbarAnalysis(processor.ProcessorABC):
         return {"hist": {}}
 
     def process(self, events):
-        if utils.config["benchmarking"]["DISABLE_PROCESSING"]:
+        if self.disable_processing:
             # IO testing with no subsequent processing
             return self.only_do_IO(events)
 
@@ -186,25 +195,15 @@ class TtbarAnalysis(processor.ProcessorABC):
         # normalization for MC
         x_sec = events.metadata["xsec"]
         nevts_total = events.metadata["nevts"]
-        lumi = 3378 # /pb
         if process != "data":
-            xsec_weight = x_sec * lumi / nevts_total
+            xsec_weight = x_sec * LUMI / nevts_total
         else:
             xsec_weight = 1
 
-        # setup triton gRPC client
-        if self.use_inference and self.use_triton:
-            triton_client = utils.clients.get_triton_client(utils.config["ml"]["TRITON_URL"])
-
 
         #### systematics
         # jet energy scale / resolution systematics
         # need to adjust schema to instead use coffea add_systematic feature, especially for ServiceX
-        # cannot attach pT variations to events.jet, so attach to events directly
-        # and subsequently scale pT by these scale factors
-        events["pt_scale_up"] = 1.03
-        events["pt_res_up"] = utils.systematics.jet_pt_resolution(events.Jet.pt)
-
         syst_variations = ["nominal"]
         jet_kinematic_systs = ["pt_scale_up", "pt_res_up"]
         event_systs = [f"btag_var_{i}" for i in range(4)]
@@ -212,9 +211,18 @@ class TtbarAnalysis(processor.ProcessorABC):
             event_systs.append("scale_var")
 
         # Only do systematics for nominal samples, e.g. ttbar__nominal
+        # event weight systematics reuse the nominal selection and ML inference, and are filled in the nominal pass
         if variation == "nominal":
             syst_variations.extend(jet_kinematic_systs)
-            syst_variations.extend(event_systs)
+            # scale factors for jet pT, kept outside of 'events' (attaching them to events adds fields that
+            # are sliced along with everything else) and only computed if the variations are evaluated
+            jet_pt_variations = {
+                "pt_scale_up": 1.03,
+                "pt_res_up": utils.systematics.jet_pt_resolution(events.Jet.pt),
+            }
+
+        if self.use_inference:
+            even = ak.to_numpy(events.event) % 2 == 0  # whether events are even/odd
 
         # for pt_var in pt_variations:
         for syst_var in syst_variations:
@@ -227,7 +235,7 @@ class TtbarAnalysis(processor.ProcessorABC):
             jets = events.Jet
             if syst_var in jet_kinematic_systs:
                 # Replace jet.pt with the adjusted values
-                jets["pt"] = jets.pt * events[syst_var]
+                jets["pt"] = jets.pt * jet_pt_variations[syst_var]
 
             electron_reqs = (elecs.pt > 30) & (np.abs(elecs.eta) < 2.1) & (elecs.cutBased == 4) & (elecs.sip3d < 4)
             muon_reqs = ((muons.pt > 30) & (np.abs(muons.eta) < 2.1) & (muons.tightId) & (muons.sip3d < 4) &
@@ -239,59 +247,86 @@ class TtbarAnalysis(processor.ProcessorABC):
             muons = muons[muon_reqs]
             jets = jets[jet_reqs]
 
-            if self.use_inference:
-                even = (events.event%2==0)  # whether events are even/odd
-
-            B_TAG_THRESHOLD = 0.5
+            # number of b-tagged jets per event, counted once (in compiled code on the flattened b-tag scores)
+            # and shared by both b-tag requirements
+            n_jets = ak.num(jets).to_numpy()
+            jet_offsets = np.concatenate(([0], np.cumsum(n_jets)))
+            n_btag = utils.reconstruction.count_btags(jet_offsets, ak.flatten(jets.btagCSVV2).to_numpy(), B_TAG_THRESHOLD)
 
             ######### Store boolean masks with PackedSelection ##########
             selections = PackedSelection(dtype='uint64')
             # Basic selection criteria
             selections.add("exactly_1l", (ak.num(elecs) + ak.num(muons)) == 1)
-            selections.add("atleast_4j", ak.num(jets) >= 4)
-            selections.add("exactly_1b", ak.sum(jets.btagCSVV2 > B_TAG_THRESHOLD, axis=1) == 1)
-            selections.add("atleast_2b", ak.sum(jets.btagCSVV2 > B_TAG_THRESHOLD, axis=1) >= 2)
+            selections.add("atleast_4j", n_jets >= 4)
+            selections.add("exactly_1b", n_btag == 1)
+            selections.add("atleast_2b", n_btag >= 2)
             # Complex selection criteria
             selections.add("4j1b", selections.all("exactly_1l", "atleast_4j", "exactly_1b"))
             selections.add("4j2b", selections.all("exactly_1l", "atleast_4j", "atleast_2b"))
 
+            # Event weight systematics only change the weights of the nominal selection
+            # they are evaluated once for all events here and gathered for each region below
+            event_wgt_variations = {}
+            if syst_var == "nominal" and variation == "nominal":
+                # pT of the four leading jets (zero-padded, events with fewer jets are not selected in any region)
+                jet_pt_4 = ak.to_numpy(ak.fill_none(ak.pad_none(jets.pt, 4, clip=True), 0))
+                btag_wgt_variations = {
+                    direction: self.cset["event_systematics"].evaluate("btag_var", direction, jet_pt_4)
+                    for direction in ["up", "down"]
+                }
+                for event_syst in event_systs:
+                    for i_dir, direction in enumerate(["up", "down"]):
+                        # Should be an event weight systematic with an up/down variation
+                        if event_syst.startswith("btag_var"):
+                            i_jet = int(event_syst.rsplit("_",1)[-1])   # Kind of fragile
+                            wgt_variation = btag_wgt_variations[direction][:, i_jet]
+                        elif event_syst == "scale_var":
+                            # The pt array is only used to make sure the output array has the correct shape
+                            wgt_variation = self.cset["event_systematics"].evaluate("scale_var", direction, jet_pt_4[:, 0])
+                        event_wgt_variations[f"{event_syst}_{direction}"] = wgt_variation
+
             for region in ["4j1b", "4j2b"]:
                 region_selection = selections.all(region)
-                region_jets = jets[region_selection]
-                region_elecs = elecs[region_selection]
-                region_muons = muons[region_selection]
-                region_weights = np.ones(len(region_jets)) * xsec_weight
-                if self.use_inference:
-                    region_even = even[region_selection]
+                # indices of selected events, computed once and used for every array that is sliced to this region
+                region_idx = np.flatnonzero(region_selection)
+                region_jets = jets[region_idx]
+                region_weights = np.full(len(region_idx), xsec_weight)
 
                 if region == "4j1b":
                     observable = ak.sum(region_jets.pt, axis=-1)
 
                 elif region == "4j2b":
 
-                    # reconstruct hadronic top as bjj system with largest pT
-                    trijet = ak.combinations(region_jets, 3, fields=["j1", "j2", "j3"])  # trijet candidates
-                    trijet["p4"] = trijet.j1 + trijet.j2 + trijet.j3  # calculate four-momentum of tri-jet system
-                    trijet["max_btag"] = np.maximum(trijet.j1.btagCSVV2, np.maximum(trijet.j2.btagCSVV2, trijet.j3.btagCSVV2))
-                    trijet = trijet[trijet.max_btag > B_TAG_THRESHOLD]  # at least one-btag in trijet candidates
-                    # pick trijet candidate with largest pT and calculate mass of system
-                    trijet_mass = trijet["p4"][ak.argmax(trijet.p4.pt, axis=1, keepdims=True)].mass
-                    observable = ak.flatten(trijet_mass)
-
-                    if sum(region_selection)==0:
+                    if len(region_idx) == 0:
                         continue
 
+                    # reconstruct hadronic top as bjj system with largest pT
+                    # (loops over all trijet candidates with at least one b-tag in compiled code)
+                    offsets = np.concatenate(([0], np.cumsum(ak.num(region_jets).to_numpy())))
+                    observable = utils.reconstruction.best_trijet_mass(
+                        offsets,
+                        ak.flatten(region_jets.pt).to_numpy(),
+                        ak.flatten(region_jets.eta).to_numpy(),
+                        ak.flatten(region_jets.phi).to_numpy(),
+                        ak.flatten(region_jets.mass).to_numpy(),
+                        ak.flatten(region_jets.btagCSVV2).to_numpy(),
+                        B_TAG_THRESHOLD,
+                    )
+
                     if self.use_inference:
                         features, perm_counts = utils.ml.get_features(
                             region_jets,
-                            region_elecs,
-                            region_muons,
+                            elecs[region_idx],
+                            muons[region_idx],
                             max_n_jets=utils.config["ml"]["MAX_N_JETS"],
                         )
-                        even_perm = np.repeat(region_even, perm_counts)
+                        even_perm = np.repeat(even[region_idx], perm_counts)
 
                         # calculate ml observable
                         if self.use_triton:
+                            # triton gRPC client and model metadata, only set up once inference is needed
+                            # (reused across chunks processed by the same worker process or dask worker)
+                            triton_client = utils.clients.get_triton_client(utils.config["ml"]["TRITON_URL"])
                             results = utils.ml.get_inference_results_triton(
                                 features,
                                 even_perm,
@@ -299,6 +334,11 @@ class TtbarAnalysis(processor.ProcessorABC):
                                 utils.config["ml"]["MODEL_NAME"],
                                 utils.config["ml"]["MODEL_VERSION_EVEN"],
                                 utils.config["ml"]["MODEL_VERSION_ODD"],
+                                model_io=utils.clients.get_triton_model_io(
+                                    utils.config["ml"]["TRITON_URL"],
+                                    utils.config["ml"]["MODEL_NAME"],
+                                    utils.config["ml"]["MODEL_VERSION_EVEN"],
+                                ),
                             )
 
                         else:
@@ -309,47 +349,26 @@ class TtbarAnalysis(processor.ProcessorABC):
                                 utils.ml.model_odd,
                             )
                             
-                        results = ak.unflatten(results, perm_counts)
-                        features = ak.flatten(ak.unflatten(features, perm_counts)[
-                            ak.from_regular(ak.argmax(results,axis=1)[:, np.newaxis])
-                        ])
+                        # only keep the features of the permutation with the highest score in each event
+                        best_perm = ak.to_numpy(ak.argmax(ak.unflatten(results, perm_counts), axis=1))
+                        features = features[np.cumsum(perm_counts) - perm_counts + best_perm]
                 syst_var_name = f"{syst_var}"
-                # Break up the filling into event weight systematics and object variation systematics
-                if syst_var in event_systs:
-                    for i_dir, direction in enumerate(["up", "down"]):
-                        # Should be an event weight systematic with an up/down variation
-                        if syst_var.startswith("btag_var"):
-                            i_jet = int(syst_var.rsplit("_",1)[-1])   # Kind of fragile
-                            wgt_variation = self.cset["event_systematics"].evaluate("btag_var", direction, region_jets.pt[:,i_jet])
-                        elif syst_var == "scale_var":
-                            # The pt array is only used to make sure the output array has the correct shape
-                            wgt_variation = self.cset["event_systematics"].evaluate("scale_var", direction, region_jets.pt[:,0])
-                        syst_var_name = f"{syst_var}_{direction}"
-                        hist_dict[region].fill(
-                            observable=observable, process=process,
-                            variation=syst_var_name, weight=region_weights * wgt_variation
+                # Should either be 'nominal' or an object variation systematic
+                if variation != "nominal":
+                    # This is a 2-point systematic, e.g. ttbar__scaledown, ttbar__ME_var, etc.
+                    syst_var_name = variation
+                variation_weights = {syst_var_name: region_weights}
+
+                for syst_var_name, wgt_variation in event_wgt_variations.items():
+                    variation_weights[syst_var_name] = region_weights * wgt_variation[region_idx]
+
+                # all variations share the observables, so each histogram is filled once with all sets of weights
+                utils.histogramming.fill_variations(hist_dict[region], observable, process, variation_weights)
+                if region == "4j2b" and self.use_inference:
+                    for i in range(len(utils.config["ml"]["FEATURE_NAMES"])):
+                        utils.histogramming.fill_variations(
+                            ml_hist_dict[utils.config["ml"]["FEATURE_NAMES"][i]], features[..., i], process, variation_weights
                         )
-                        if region == "4j2b" and self.use_inference:
-                            for i in range(len(utils.config["ml"]["FEATURE_NAMES"])):
-                                ml_hist_dict[utils.config["ml"]["FEATURE_NAMES"][i]].fill(
-                                    observable=features[..., i], process=process,
-                                    variation=syst_var_name, weight=region_weights * wgt_variation
-                                )
-                else:
-                    # Should either be 'nominal' or an object variation systematic
-                    if variation != "nominal":
-                        # This is a 2-point systematic, e.g. ttbar__scaledown, ttbar__ME_var, etc.
-                        syst_var_name = variation
-                    hist_dict[region].fill(
-                        observable=observable, process=process,
-                        variation=syst_var_name, weight=region_weights
-                    )
-                    if region == "4j2b" and self.use_inference:
-                        for i in range(len(utils.config["ml"]["FEATURE_NAMES"])):
-                            ml_hist_dict[utils.config["ml"]["FEATURE_NAMES"][i]].fill(
-                                observable=features[..., i], process=process,
-                                variation=syst_var_name, weight=region_weights
-                            )
 
 
         output = {"nevents": {events.metadata["dataset"]: len(events)}, "hist_dict": hist_dict}
@@ -371,6 +390,7 @@ fileset = utils.file_input.construct_fileset(
     N_FILES_MAX_PER_SAMPLE,
     use_xcache=False,
     af_name=utils.config["benchmarking"]["AF_NAME"],  # local files on /data for af_name="ssl-dev"
+    local_data_cache=utils.config["benchmarking"]["LOCAL_DATA_CACHE"],
     input_from_eos=utils.config["benchmarking"]["INPUT_FROM_EOS"],
     xcache_atlas_prefix=utils.config["benchmarking"]["XCACHE_ATLAS_PREFIX"],
 )
@@ -390,6 +410,7 @@ def get_query(source):
     """Query for event / column selection: >=4j >=1b, ==1 lep with pT>30 GeV + additional cuts,
     return relevant columns
     *NOTE* jet pT cut is set lower to account for systematic variations to jet pT
+    *NOTE* both jet requirements are applied in a single Where, so events are only filtered once for them
     """
     cuts = source.Where(lambda e: {"pt": e.Electron_pt,
                                "eta": e.Electron_eta,
@@ -413,15 +434,15 @@ def get_query(source):
                                           "jetId": f.Jet_jetId}.Zip()\
                                .Where(lambda jet: (jet.pt > 25
                                                    and abs(jet.eta) < 2.4
-                                                   and jet.jetId == 6)).Count() >= 4)\
-                        .Where(lambda g: {"pt": g.Jet_pt,
-                                          "eta": g.Jet_eta,
-                                          "btagCSVV2": g.Jet_btagCSVV2,
-                                          "jetId": g.Jet_jetId}.Zip()\
-                        .Where(lambda jet: (jet.btagCSVV2 > 0.5
-                                            and jet.pt > 25
-                                            and abs(jet.eta) < 2.4)
-                                            and jet.jetId == 6).Count() >= 1)
+                                                   and jet.jetId == 6)).Count() >= 4
+                                         and {"pt": f.Jet_pt,
+                                              "eta": f.Jet_eta,
+                                              "btagCSVV2": f.Jet_btagCSVV2,
+                                              "jetId": f.Jet_jetId}.Zip()\
+                               .Where(lambda jet: (jet.btagCSVV2 > 0.5
+                                                   and jet.pt > 25
+                                                   and abs(jet.eta) < 2.4
+                                                   and jet.jetId == 6)).Count() >= 1)
     selection = cuts.Select(lambda h: {"Electron_pt": h.Electron_pt,
                                        "Electron_eta": h.Electron_eta,
                                        "Electron_phi": h.Electron_phi,
@@ -489,16 +510,25 @@ if USE_SERVICEX:
     # create the query
     query = get_query(dummy_ds).value()
 
-    # now we query the files using a wrapper around ServiceXDataset to transform all processes at once
+    # reuse signed URLs from a previous delivery of the same query if they are still valid
+    url_file = "servicex_urls.json"
+    urls_per_process = None
+    if not utils.config["global"]["SERVICEX_IGNORE_CACHE"]:
+        urls_per_process = utils.file_input.load_servicex_urls(url_file, query, fileset)
+
     t0 = time.time()
-    ds = utils.file_input.ServiceXDatasetGroup(fileset, backend_name="uproot", ignore_cache=utils.config["global"]["SERVICEX_IGNORE_CACHE"])
-    files_per_process = ds.get_data_rootfiles_uri(query, as_signed_url=True, title="CMS ttbar")
+    if urls_per_process is None:
+        # now we query the files using a wrapper around ServiceXDataset to transform all processes at once
+        ds = utils.file_input.ServiceXDatasetGroup(fileset, backend_name="uproot", ignore_cache=utils.config["global"]["SERVICEX_IGNORE_CACHE"])
+        files_per_process = ds.get_data_rootfiles_uri(query, as_signed_url=True, title="CMS ttbar")
+        urls_per_process = {process: [f.url for f in files_per_process[process]] for process in fileset.keys()}
+        utils.file_input.save_servicex_urls(url_file, query, fileset, urls_per_process)
 
     print(f"ServiceX data delivery took {time.time() - t0:.2f} seconds")
 
     # update fileset to point to ServiceX-transformed files
     for process in fileset.keys():
-        fileset[process]["files"] = [f.url for f in files_per_process[process]]
+        fileset[process]["files"] = urls_per_process[process]
 
 # %% [markdown]
 # ### Execute the data delivery pipeline
@@ -515,24 +545,44 @@ if USE_DASK:
 else:
     executor = processor.FuturesExecutor(workers=utils.config["benchmarking"]["NUM_CORES"])
 
-run = processor.Runner(
-    executor=executor,
-    schema=NanoAODSchema,
-    savemetrics=True,
-    metadata_cache={},
-    chunksize=utils.config["benchmarking"]["CHUNKSIZE"])
-
 if USE_SERVICEX:
     treename = "servicex"
 
 else:
     treename = "Events"
 
+if utils.config["benchmarking"]["CHUNKSIZE"] == "auto":
+    # pick chunk size from average event size in input files (selected value is also saved with the metrics),
+    # counting only the branches that are read: the IO branches for IO tests, otherwise those used by TtbarAnalysis
+    if utils.config["benchmarking"]["DISABLE_PROCESSING"]:
+        read_branches = utils.config["benchmarking"]["IO_BRANCHES"][utils.config["benchmarking"]["IO_FILE_PERCENT"]]
+    else:
+        read_branches = ["event", "Jet_pt", "Jet_eta", "Jet_phi", "Jet_mass", "Jet_btagCSVV2", "Jet_jetId", "Jet_qgl",
+                         "Electron_pt", "Electron_eta", "Electron_phi", "Electron_mass", "Electron_cutBased",
+                         "Electron_sip3d", "Muon_pt", "Muon_eta", "Muon_phi", "Muon_mass", "Muon_tightId",
+                         "Muon_sip3d", "Muon_pfRelIso04_all"]
+    utils.config["benchmarking"]["CHUNKSIZE"] = utils.file_input.calibrate_chunksize(fileset, treename, read_branches)
+    print(f"using chunk size of {utils.config['benchmarking']['CHUNKSIZE']} events")
+
+# file metadata found in previous runs (skips opening these files again during pre-processing)
+metadata_cache = utils.file_input.load_metadata_cache("metadata_cache.pkl")
+
+run = processor.Runner(
+    executor=executor,
+    schema=NanoAODSchema,
+    savemetrics=True,
+    metadata_cache=metadata_cache,
+    chunksize=utils.config["benchmarking"]["CHUNKSIZE"],
+    # start chunks at ROOT cluster boundaries, so that baskets are not fetched by two neighboring chunks
+    # and every task reads whole clusters with few, large requests
+    align_clusters=True)
+
 # load local models if not using Triton and models are not yet loaded
 if USE_INFERENCE and not USE_TRITON and utils.ml.model_even is None and utils.ml.model_odd is None:
     utils.ml.load_models()
 
 filemeta = run.preprocess(fileset, treename=treename)  # pre-processing
+utils.file_input.save_metadata_cache(metadata_cache, "metadata_cache.pkl", fileset)
 
 t0 = time.monotonic()
 # processing
@@ -545,6 +595,9 @@ exec_time = time.monotonic() - t0
 
 print(f"\nexecution took {exec_time:.2f} seconds")
 
+# give memory used during processing back to the operating system before the following steps
+utils.memory.release_memory()
+
 # %%
 # track metrics
 utils.metrics.track_metrics(metrics, fileset, exec_time, USE_DASK, USE_SERVICEX, N_FILES_MAX_PER_SAMPLE, USE_INFERENCE, USE_TRITON)
@@ -582,20 +635,20 @@ plt.xlabel("$m_{bjj}$ [GeV]");
 
 # %%
 # b-tagging variations
-all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", "nominal"].plot(label="nominal", linewidth=2)
-all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", "btag_var_0_up"].plot(label="NP 1", linewidth=2)
-all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", "btag_var_1_up"].plot(label="NP 2", linewidth=2)
-all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", "btag_var_2_up"].plot(label="NP 3", linewidth=2)
-all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", "btag_var_3_up"].plot(label="NP 4", linewidth=2)
+# (slice and rebin once for all variations, then pick out the individual variations)
+h_ttbar_4j1b = all_histograms["hist_dict"]["4j1b"][120j::hist.rebin(2), "ttbar", :]
+for variation, label in [("nominal", "nominal"), ("btag_var_0_up", "NP 1"), ("btag_var_1_up", "NP 2"),
+                         ("btag_var_2_up", "NP 3"), ("btag_var_3_up", "NP 4")]:
+    h_ttbar_4j1b[:, variation].plot(label=label, linewidth=2)
 plt.legend(frameon=False)
 plt.xlabel("$H_T$ [GeV]")
 plt.title("b-tagging variations");
 
 # %%
 # jet energy scale variations
-all_histograms["hist_dict"]["4j2b"][:, "ttbar", "nominal"].plot(label="nominal", linewidth=2)
-all_histograms["hist_dict"]["4j2b"][:, "ttbar", "pt_scale_up"].plot(label="scale up", linewidth=2)
-all_histograms["hist_dict"]["4j2b"][:, "ttbar", "pt_res_up"].plot(label="resolution up", linewidth=2)
+h_ttbar_4j2b = all_histograms["hist_dict"]["4j2b"][:, "ttbar", :]
+for variation, label in [("nominal", "nominal"), ("pt_scale_up", "scale up"), ("pt_res_up", "resolution up")]:
+    h_ttbar_4j2b[:, variation].plot(label=label, linewidth=2)
 plt.legend(frameon=False)
 plt.xlabel("$m_{bjj}$ [Gev]")
 plt.title("Jet energy variations");
@@ -633,6 +686,8 @@ utils.file_output.save_histograms(all_histograms['hist_dict'], "histograms.root"
 if USE_INFERENCE:
     utils.file_output.save_histograms(all_histograms['ml_hist_dict'], "histograms_ml.root", add_offset=True)
 
+utils.memory.release_memory()
+
 # %% [markdown]
 # ### Statistical inference
 #
@@ -644,16 +699,32 @@ if USE_INFERENCE:
 # We will use `cabinetry` to combine all histograms into a `pyhf` workspace and fit the resulting statistical model to the pseudodata we built.
 
 # %%
-import utils.rebinning  # noqa: E402
+import multiprocessing  # noqa: E402
+from concurrent.futures import ProcessPoolExecutor  # noqa: E402
+
+import utils.workspaces  # noqa: E402
 
 cabinetry_config = cabinetry.configuration.load("cabinetry_config.yml")
 
+# the workspace for the ML validation further below does not depend on the fit, so it is built in a separate process
+# in the meantime (it is the slowest part of building workspaces, with one channel per ML observable)
+if USE_INFERENCE:
+    # spawn instead of fork: the kernel already runs other threads (dask client, numba) at this point
+    ml_workspace_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    ws_ml_future = ml_workspace_pool.submit(
+        utils.workspaces.build_workspace,
+        "cabinetry_config_ml.yml",
+        "workspace_ml.json",
+        pruned_channels=["Feature3", "Feature8", "Feature9",
+                         "Feature10", "Feature11", "Feature12",
+                         "Feature13", "Feature14", "Feature15",
+                         "Feature16", "Feature17", "Feature18",
+                         "Feature19"],
+    )
+
 # rebinning: lower edge 110 GeV, merge bins 2->1
-rebinning_router = utils.rebinning.get_cabinetry_rebinning_router(cabinetry_config, rebinning=slice(110j, None, hist.rebin(2)))
-cabinetry.templates.build(cabinetry_config, router=rebinning_router)
-cabinetry.templates.postprocess(cabinetry_config)  # optional post-processing (e.g. smoothing)
-ws = cabinetry.workspace.build(cabinetry_config)
-cabinetry.workspace.save(ws, "workspace.json")
+# (workspaces are only rebuilt if histograms, configuration, rebinning or pruning changed since they were last built)
+ws = utils.workspaces.build_workspace("cabinetry_config.yml", "workspace.json", rebinning=slice(110j, None, hist.rebin(2)))
 
 # %% [markdown]
 # We can inspect the workspace with `pyhf`, or use `pyhf` to perform inference.
@@ -698,17 +769,8 @@ utils.plotting.plot_data_mc(model_prediction, model_prediction_postfit, data, ca
 # load the ml workspace (uses the ml observable instead of previous method)
 if USE_INFERENCE:
     config_ml = cabinetry.configuration.load("cabinetry_config_ml.yml")
-    cabinetry.templates.collect(config_ml)
-    cabinetry.templates.postprocess(config_ml)  # optional post-processing (e.g. smoothing)
-
-    ws_ml = cabinetry.workspace.build(config_ml)
-    ws_pruned = pyhf.Workspace(ws_ml).prune(channels=["Feature3", "Feature8", "Feature9",
-                                                      "Feature10", "Feature11", "Feature12",
-                                                      "Feature13", "Feature14", "Feature15",
-                                                      "Feature16", "Feature17", "Feature18",
-                                                      "Feature19"])
-
-    cabinetry.workspace.save(ws_pruned, "workspace_ml.json")
+    ws_pruned = ws_ml_future.result()  # built in the background since the statistical inference started
+    ml_workspace_pool.shutdown()
 
 # %%
 if USE_INFERENCE:
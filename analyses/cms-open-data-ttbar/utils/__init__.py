@@ -3,9 +3,12 @@ from .config import config as config
 from .config_training import config as config_training  # noqa: F401
 from . import file_input as file_input
 from . import file_output as file_output
+from . import histogramming as histogramming
+from . import memory as memory
 from . import metrics as metrics
 from . import ml as ml
 from . import plotting as plotting
+from . import reconstruction as reconstruction
 from . import systematics as systematics
 
 
@@ -1,3 +1,8 @@
+import os
+
+from .config import config
+
+
 def get_client(af="coffea_casa"):
     if af == "coffea_casa":
         from dask.distributed import Client
@@ -29,18 +34,65 @@ def get_client(af="coffea_casa"):
         client = cluster.get_client()
         
     elif af == "local":
-        from dask.distributed import Client
+        from dask.distributed import Client, LocalCluster
 
-        client = Client()
+        # one single-threaded worker process per core (no GIL contention between chunks), glibc is
+        # told to return memory freed after each chunk to the OS instead of keeping it in its arenas
+        cluster = LocalCluster(
+            n_workers=config["benchmarking"]["NUM_CORES"],
+            threads_per_worker=1,
+            env={"MALLOC_TRIM_THRESHOLD_": "65536"},
+        )
+        client = Client(cluster)
 
     else:
         raise NotImplementedError(f"unknown analysis facility: {af}")
 
     return client
 
+
+# Triton clients are reused across chunks processed by the same worker process
+# (keyed by process ID, since gRPC channels must not be shared with forked processes),
+# together with the model metadata requested through them
+_triton_clients = {}
+
+
+def _get_triton_cache():
+    # with dask, utils is shipped by value along with the processor and unpickled again for every chunk, so this module
+    # starts out empty for every task: keep the clients on the dask worker instead, which outlives the tasks
+    try:
+        from dask.distributed import get_worker
+        worker = get_worker()
+    except (ImportError, ValueError):
+        # not running on a dask worker
+        return _triton_clients
+
+    if not hasattr(worker, "agc_triton_clients"):
+        worker.agc_triton_clients = {}
+    return worker.agc_triton_clients
+
+
+def _get_triton_entry(triton_url):
+    triton_cache = _get_triton_cache()
+    key = (os.getpid(), triton_url)
+    if key not in triton_cache:
+        import tritonclient.grpc as grpcclient
+        triton_cache[key] = {"client": grpcclient.InferenceServerClient(url=triton_url), "model_io": {}}
+
+    return triton_cache[key]
+
+
 def get_triton_client(triton_url):
-    
-    import tritonclient.grpc as grpcclient
-    triton_client = grpcclient.InferenceServerClient(url=triton_url)
-    
-    return triton_client
+    return _get_triton_entry(triton_url)["client"]
+
+
+def get_triton_model_io(triton_url, model_name, model_version):
+    # model metadata does not change while processing, only ask the server once per client
+    model_io = _get_triton_entry(triton_url)["model_io"]
+    if (model_name, model_version) not in model_io:
+        model_metadata = get_triton_client(triton_url).get_model_metadata(model_name, model_version)
+        model_io[(model_name, model_version)] = (
+            model_metadata.inputs[0].name, model_metadata.inputs[0].datatype, model_metadata.outputs[0].name
+        )
+
+    return model_io[(model_name, model_version)]
@@ -13,12 +13,15 @@ config = {
 
     },
     "benchmarking": {
-        # chunk size to use
+        # chunk size to use, "auto" picks it based on the average event size in the input files
         "CHUNKSIZE": 200000,
         # read files from public EOS (thanks to the CMS DPOA team!)
         # note that they are likely only available temporarily
         # and not part of an official CMS Open Data release
         "INPUT_FROM_EOS": False,
+        # writable directory to keep local copies of the input files in: files are downloaded once on first use
+        # and read from disk in all subsequent runs (None to always read from the remote source)
+        "LOCAL_DATA_CACHE": None,
         # prefix for URIs for ATLAS-style xcache use
         # e.g. "root://xcache.af.uchicago.edu//" for UChicago
         "XCACHE_ATLAS_PREFIX": None,
@@ -29,7 +32,7 @@ config = {
         "SYSTEMATICS": "all",
         # does not do anything, only used for metric gathering (set to 1 for distributed coffea-casa)
         "CORES_PER_WORKER": 1,
-        # scaling for local setups with FuturesExecutor
+        # scaling for local setups with FuturesExecutor (or a local Dask cluster with AF = "local")
         "NUM_CORES": 4,
         # only I/O, all other processing disabled
         "DISABLE_PROCESSING": False,
@@ -2,8 +2,11 @@ import json
 import numpy as np
 import os
 from pathlib import Path
+import pickle
+import time
 import tqdm
-import urllib
+import uproot
+import urllib.request
 
 
 try:
@@ -91,6 +94,29 @@ def construct_fileset(n_files_max_per_sample, use_xcache=False, af_name="", loca
     return fileset
 
 
+# Chunk size (number of events) that corresponds to roughly target_bytes of uncompressed event data, based on the
+# average event size in the first file of up to max_files entries in the fileset. Small chunks increase per-task overhead,
+# while large chunks increase the peak memory usage per worker, so the result is clipped to [min_chunksize, max_chunksize].
+# Only the given branches count towards the event size: this assumes they are the ones read during processing, and a
+# NanoAOD event holds far more data than the processor ever reads. Branches missing from a file are skipped.
+def calibrate_chunksize(fileset, treename, branches, target_bytes=50_000_000, min_chunksize=50_000,
+                        max_chunksize=500_000, max_files=3):
+    event_sizes = []
+    # a few files are enough for an average, and each of them is opened before any processing starts
+    for process in list(fileset.keys())[:max_files]:
+        with uproot.open(fileset[process]["files"][0]) as f:
+            tree = f[treename]
+            if tree.num_entries > 0:
+                read_bytes = sum(tree[branch].uncompressed_bytes for branch in branches if branch in tree)
+                event_sizes.append(read_bytes / tree.num_entries)
+
+    if len(event_sizes) == 0 or np.mean(event_sizes) == 0:
+        return max_chunksize
+
+    chunksize = int(target_bytes // np.mean(event_sizes))
+    return max(min_chunksize, min(max_chunksize, chunksize))
+
+
 def tqdm_urlretrieve_hook(t):
     """From https://github.com/tqdm/tqdm/blob/master/examples/tqdm_wget.py ."""
     last_b = [0]
@@ -117,8 +143,57 @@ def tqdm_urlretrieve_hook(t):
 def download_file(url, out_file):
     out_path = Path(out_file)
     out_path.parent.mkdir(parents=True, exist_ok=True)
+    # download to a temporary name first and only move it into place once complete, so that an interrupted
+    # download is not mistaken for a cached file in the next run
+    part_path = out_path.with_name(out_path.name + ".part")
     with tqdm.tqdm(unit='B', unit_scale=True, unit_divisor=1024, miniters=1, desc=out_path.name) as t:
-        urllib.request.urlretrieve(url, out_path.absolute(), reporthook=tqdm_urlretrieve_hook(t))
+        urllib.request.urlretrieve(url, part_path.absolute(), reporthook=tqdm_urlretrieve_hook(t))
+    part_path.replace(out_path)
+
+
+# URLs of files delivered by ServiceX are signed and stay valid for a limited time (7 days for the MinIO default).
+# They are saved to disk together with the query, input files and time of delivery, so that re-running the notebook
+# can reuse them without contacting ServiceX again, as long as they are not about to expire.
+def save_servicex_urls(path, query, fileset, urls_per_process):
+    with open(path, "w") as f:
+        json.dump({
+            "query": query,
+            "time": time.time(),
+            "inputs": {process: fileset[process]["files"] for process in fileset.keys()},
+            "urls": urls_per_process,
+        }, f)
+
+
+def load_servicex_urls(path, query, fileset, max_age=6*24*60*60):
+    # returns None if there are no saved URLs for this query and these input files, or if they are older than max_age seconds
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        saved = json.load(f)
+
+    inputs = {process: fileset[process]["files"] for process in fileset.keys()}
+    if saved["query"] != query or saved["inputs"] != inputs or time.time() - saved["time"] > max_age:
+        return None
+
+    return saved["urls"]
+
+
+# coffea's metadata cache (number of entries and cluster boundaries per file, keyed by file name and tree name) is saved
+# to disk after pre-processing, so that files already opened in a previous run do not need to be opened again
+# (only entries for files in the current fileset are kept, e.g. signed ServiceX URLs change with every transform)
+def load_metadata_cache(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def save_metadata_cache(metadata_cache, path, fileset):
+    filenames = {filename for process in fileset.keys() for filename in fileset[process]["files"]}
+    with open(path, "wb") as f:
+        pickle.dump({k: v for k, v in metadata_cache.items() if k.filename in filenames}, f)
 
 
 class ServiceXDatasetGroup():
@@ -1,8 +1,11 @@
+import hashlib
+import os
+
 import uproot
 
 
-def save_histograms(hist_dict, filename, add_offset=False):
-    with uproot.recreate(filename) as f:
+def save_histograms(hist_dict, filename, add_offset=False, compression=uproot.ZLIB(1)):
+    with uproot.recreate(filename, compression=compression) as f:
         # save all available histograms to disk
         for channel, histogram in hist_dict.items():
             # optionally add minimal offset to avoid completely empty bins
@@ -15,15 +18,16 @@ def save_histograms(hist_dict, filename, add_offset=False):
             else:
                 empty_hist_yield = 0
 
-            for sample in histogram.axes[1]:
-                for variation in histogram[:, sample, :].axes[1]:
-                    variation_string = "" if variation == "nominal" else f"_{variation}"
-                    current_1d_hist = histogram[:, sample, variation]
+            # yields for all combinations of sample and variation at once
+            yields = histogram.values().sum(axis=0)
 
-                    if sum(current_1d_hist.values()) > empty_hist_yield:
+            for i_sample, sample in enumerate(histogram.axes[1]):
+                for i_variation, variation in enumerate(histogram.axes[2]):
+                    if yields[i_sample, i_variation] > empty_hist_yield:
                         # only save histograms containing events
                         # many combinations are not used (e.g. ME var for W+jets)
-                        f[f"{channel}_{sample}{variation_string}"] = current_1d_hist
+                        variation_string = "" if variation == "nominal" else f"_{variation}"
+                        f[f"{channel}_{sample}{variation_string}"] = histogram[:, sample, variation]
 
             # add pseudodata histogram if all inputs to it are available
             if (
@@ -34,3 +38,32 @@ def save_histograms(hist_dict, filename, add_offset=False):
                 f[f"{channel}_pseudodata"] = (
                     histogram[:, "ttbar", "ME_var"] + histogram[:, "ttbar", "PS_var"]
                 ) / 2 + histogram[:, "wjets", "nominal"]
+
+
+def get_histogram_hash(filename, extra=""):
+    # SHA-256 hash of the contents of all histograms in a file, independent of the order they were written in and of
+    # ROOT file metadata (such as creation time), optionally including additional information (e.g. a configuration)
+    content_hash = hashlib.sha256(extra.encode())
+    with uproot.open(filename) as f:
+        for key in sorted(f.keys(cycle=False)):
+            histogram = f[key]
+            content_hash.update(key.encode())
+            content_hash.update(histogram.axis().edges().tobytes())
+            content_hash.update(histogram.values(flow=True).tobytes())
+            content_hash.update(histogram.variances(flow=True).tobytes())
+
+    return content_hash.hexdigest()
+
+
+# the hash of the inputs an output was built from is saved next to it, so that it only needs to be rebuilt when they change
+def is_up_to_date(filename, content_hash):
+    if not os.path.exists(filename) or not os.path.exists(f"{filename}.sha256"):
+        return False
+
+    with open(f"{filename}.sha256") as f:
+        return f.read() == content_hash
+
+
+def save_hash(filename, content_hash):
+    with open(f"{filename}.sha256", "w") as f:
+        f.write(content_hash)
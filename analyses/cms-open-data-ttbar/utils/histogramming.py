@@ -0,0 +1,32 @@
+import numpy as np
+
+
+def fill_variations(histogram, observable, process, variation_weights):
+    """
+    Fill several variations that share the same observable values into a histogram with axes (observable, process, variation)
+    and Weight storage. The bin lookup is done once and the weights of each variation are accumulated directly into the
+    histogram storage, instead of calling histogram.fill once per variation.
+
+    Args:
+        histogram: hist.Hist to fill
+        observable: observable values, shared by all variations
+        process: name of the process category
+        variation_weights: dictionary mapping variation names to arrays of weights (same length as observable)
+    """
+    variations = list(variation_weights.keys())
+    # make sure all categories exist (growing the category axes) by filling zero-weight entries
+    histogram.fill(
+        observable=np.zeros(len(variations)), process=process,
+        variation=variations, weight=np.zeros(len(variations))
+    )
+
+    view = histogram.view(flow=True)
+    process_idx = histogram.axes["process"].index(process)
+    # shift by one to account for the underflow bin of the observable axis
+    bin_idx = histogram.axes["observable"].index(np.asarray(observable)) + 1
+    n_bins = view.shape[0]
+
+    for variation, weight in variation_weights.items():
+        variation_idx = histogram.axes["variation"].index(variation)
+        view.value[:, process_idx, variation_idx] += np.bincount(bin_idx, weights=weight, minlength=n_bins)
+        view.variance[:, process_idx, variation_idx] += np.bincount(bin_idx, weights=weight ** 2, minlength=n_bins)
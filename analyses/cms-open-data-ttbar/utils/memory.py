@@ -0,0 +1,14 @@
+import ctypes
+import gc
+
+
+def release_memory():
+    # run the garbage collector and ask glibc to return freed heap memory to the operating system, which it otherwise
+    # keeps for reuse within the process (no-op for other C libraries)
+    gc.collect()
+    try:
+        libc = ctypes.CDLL("libc.so.6")
+    except OSError:
+        return
+
+    libc.malloc_trim(0)
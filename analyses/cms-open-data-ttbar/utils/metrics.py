@@ -1,7 +1,10 @@
-import json
 import os
 import time
 
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
+
 from .config import config
 
 def track_metrics(metrics, fileset, exec_time, USE_DASK, USE_SERVICEX, N_FILES_MAX_PER_SAMPLE, USE_INFERENCE, USE_TRITON):
@@ -44,8 +47,15 @@ def track_metrics(metrics, fileset, exec_time, USE_DASK, USE_SERVICEX, N_FILES_M
     timestamp = time.strftime('%Y%m%d-%H%M%S')
     af_name = metrics["af"]
     metric_file_name = f"metrics/{af_name}-{timestamp}.json"
-    with open(metric_file_name, "w") as f:
-        f.write(json.dumps(metrics))
+    with open(metric_file_name, "wb") as f:
+        f.write(orjson.dumps(metrics, option=orjson.OPT_SERIALIZE_NUMPY))
+
+    # also append metrics of this run to a Parquet dataset (partitioned by facility and data source) collecting all runs,
+    # which allows reading only the needed columns across all runs, e.g. pq.read_table("metrics/parquet", columns=[...])
+    # (the list of columns read is only kept in the JSON file, its type cannot be inferred when it is empty)
+    run_metrics = {k: v for k, v in metrics.items() if k != "columns"}
+    run_metrics["timestamp"] = timestamp
+    pq.write_to_dataset(pa.Table.from_pylist([run_metrics]), root_path="metrics/parquet", partition_cols=["af", "dataset_source"])
 
     print(f"metrics saved as {metric_file_name}")
     #print(f"event rate per worker (full execution time divided by NUM_CORES={NUM_CORES}): {metrics['entries'] / NUM_CORES / exec_time / 1_000:.2f} kHz")
@@ -1,8 +1,11 @@
+import math
+import queue
+
 import awkward as ak
+import numba
 import numpy as np
 from xgboost import XGBClassifier
 from .config import config
-import vector
 
 
 # local loading of ML models
@@ -99,6 +102,125 @@ def get_permutations_dict(MAX_N_JETS, include_labels=False, include_eval_mat=Fal
         return permutations_dict
 
 
+# permutation tables by maximum number of jets (a plain dict, so that it is pickled by value with utils for dask workers)
+_permutation_tables = {}
+
+
+def get_permutation_table(max_n_jets):
+    """
+    Get the permutations from get_permutations_dict as a single contiguous array, for use in compiled code.
+
+    Args:
+        max_n_jets: maximum number of jets to consider for permutations (ordered by pT)
+
+    Returns:
+        perm_table: int8 array of shape (max_n_jets + 1, maximum number of permutations, 4), where perm_table[n, :n_perms[n]]
+                    holds the permutation indices for events with n jets (unused entries are -1)
+        n_perms: number of permutations for each number of jets (0 below 4 jets)
+    """
+    if max_n_jets not in _permutation_tables:
+        permutations_dict = get_permutations_dict(max_n_jets)
+        n_perms = np.zeros(max_n_jets + 1, dtype=np.int64)
+        for n, perms in permutations_dict.items():
+            n_perms[n] = len(perms)
+
+        perm_table = np.full((max_n_jets + 1, n_perms.max(), 4), -1, dtype=np.int8)
+        for n, perms in permutations_dict.items():
+            perm_table[n, :n_perms[n]] = perms
+
+        _permutation_tables[max_n_jets] = (perm_table, n_perms)
+
+    return _permutation_tables[max_n_jets]
+
+
+@numba.njit(parallel=True, cache=True)
+def _build_perm_flat(njet, jet_starts, perm_table, perm_offsets):
+    # flat permutation indices, pointing into the flattened jet arrays
+    perm_flat = np.empty((perm_offsets[-1], 4), dtype=np.int64)
+    for i in numba.prange(len(njet)):
+        for j in range(perm_offsets[i + 1] - perm_offsets[i]):
+            for m in range(4):
+                perm_flat[perm_offsets[i] + j, m] = perm_table[njet[i], j, m] + jet_starts[i]
+
+    return perm_flat
+
+
+def _to_cartesian(pt, eta, phi, mass):
+    # (px, py, pz, E) from (pt, eta, phi, mass), vectorized over all objects
+    px = pt * np.cos(phi)
+    py = pt * np.sin(phi)
+    pz = pt * np.sinh(eta)
+    return px, py, pz, np.sqrt(px ** 2 + py ** 2 + pz ** 2 + mass ** 2)
+
+
+@numba.njit(fastmath=True, cache=True)
+def _delta_r(eta1, phi1, eta2, phi2):
+    return math.sqrt((eta1 - eta2) ** 2 + (phi1 - phi2) ** 2)
+
+
+@numba.njit(fastmath=True, cache=True)
+def _mass(px, py, pz, e):
+    return math.sqrt(max(e ** 2 - px ** 2 - py ** 2 - pz ** 2, 0.0))
+
+
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def _fill_features(jet_pt, jet_eta, jet_phi, jet_px, jet_py, jet_pz, jet_e, jet_btag, jet_qgl,
+                   lep_eta, lep_phi, lep_px, lep_py, lep_pz, lep_e, perm_flat, perm_offsets, features):
+    # fill all features in a single pass over the permutations of each event,
+    # four-momenta are precomputed per object since every jet appears in many permutations
+    for i in numba.prange(len(perm_offsets) - 1):
+        for k in range(perm_offsets[i], perm_offsets[i + 1]):
+            w1, w2, b_tophad, b_toplep = perm_flat[k, 0], perm_flat[k, 1], perm_flat[k, 2], perm_flat[k, 3]
+
+            # read all needed properties of the jets in this permutation before writing any feature
+            w1_eta, w2_eta, bh_eta, bl_eta = jet_eta[w1], jet_eta[w2], jet_eta[b_tophad], jet_eta[b_toplep]
+            w1_phi, w2_phi, bh_phi, bl_phi = jet_phi[w1], jet_phi[w2], jet_phi[b_tophad], jet_phi[b_toplep]
+            w_px, w_py, w_pz, w_e = jet_px[w1] + jet_px[w2], jet_py[w1] + jet_py[w2], jet_pz[w1] + jet_pz[w2], jet_e[w1] + jet_e[w2]
+            top_px, top_py, top_pz, top_e = w_px + jet_px[b_tophad], w_py + jet_py[b_tophad], w_pz + jet_pz[b_tophad], w_e + jet_e[b_tophad]
+            lep_b_px, lep_b_py, lep_b_pz, lep_b_e = (lep_px[i] + jet_px[b_toplep], lep_py[i] + jet_py[b_toplep],
+                                                     lep_pz[i] + jet_pz[b_toplep], lep_e[i] + jet_e[b_toplep])
+
+            # delta R between b_toplep and lepton
+            features[k, 0] = _delta_r(lep_eta[i], lep_phi[i], bl_eta, bl_phi)
+
+            # delta R between the two W
+            features[k, 1] = _delta_r(w1_eta, w1_phi, w2_eta, w2_phi)
+
+            # delta R between W and b_tophad
+            features[k, 2] = _delta_r(w1_eta, w1_phi, bh_eta, bh_phi)
+            features[k, 3] = _delta_r(w2_eta, w2_phi, bh_eta, bh_phi)
+
+            # combined mass of b_toplep and lepton
+            features[k, 4] = _mass(lep_b_px, lep_b_py, lep_b_pz, lep_b_e)
+
+            # combined mass of W
+            features[k, 5] = _mass(w_px, w_py, w_pz, w_e)
+
+            # combined mass of W and b_tophad
+            features[k, 6] = _mass(top_px, top_py, top_pz, top_e)
+
+            # combined pT of W and b_tophad
+            features[k, 7] = math.sqrt(top_px ** 2 + top_py ** 2)
+
+            # pt of every jet
+            features[k, 8] = jet_pt[w1]
+            features[k, 9] = jet_pt[w2]
+            features[k, 10] = jet_pt[b_tophad]
+            features[k, 11] = jet_pt[b_toplep]
+
+            # btagCSVV2 of every jet
+            features[k, 12] = jet_btag[w1]
+            features[k, 13] = jet_btag[w2]
+            features[k, 14] = jet_btag[b_tophad]
+            features[k, 15] = jet_btag[b_toplep]
+
+            # quark-gluon likelihood discriminator of every jet
+            features[k, 16] = jet_qgl[w1]
+            features[k, 17] = jet_qgl[w2]
+            features[k, 18] = jet_qgl[b_tophad]
+            features[k, 19] = jet_qgl[b_toplep]
+
+
 def get_features(jets, electrons, muons, max_n_jets=6):
     """
     Calculate features for each of the 12 combinations per event
@@ -113,127 +235,103 @@ def get_features(jets, electrons, muons, max_n_jets=6):
         features (flattened to remove event level)
         perm_counts: how many permutations in each event. use to unflatten features
     """
-    # for four-vector addition of custom Momentum4D instances below
-    vector.register_awkward()
-
-    permutations_dict = get_permutations_dict(max_n_jets)
+    perm_table, n_perms = get_permutation_table(max_n_jets)
 
     # calculate number of jets in each event
-    njet = ak.num(jets).to_numpy()
+    counts = ak.num(jets).to_numpy().astype(np.int64)
     # don't consider every jet for events with high jet multiplicity
-    njet[njet > max(permutations_dict.keys())] = max(permutations_dict.keys())
-    # create awkward array of permutation indices
-    perms = ak.Array([permutations_dict[n] for n in njet])
-    perm_counts = ak.num(perms)
+    njet = np.minimum(counts, max_n_jets)
+
+    # index of the first jet of every event in the flattened jet arrays
+    jet_starts = np.cumsum(counts) - counts
+    # number of permutations per event, looked up by number of jets
+    perm_counts = n_perms[njet]
+    perm_offsets = np.concatenate(([0], np.cumsum(perm_counts)))
+    # flattened permutation indices, shape (number of permutations, 4), pointing into the flattened jet arrays
+    perm_flat = _build_perm_flat(njet, jet_starts, perm_table, perm_offsets)
+
+    # flatten all needed jet and lepton properties once (as float32), all features are calculated on these NumPy arrays
+    jet_pt = ak.flatten(jets.pt).to_numpy().astype(np.float32, copy=False)
+    jet_eta = ak.flatten(jets.eta).to_numpy().astype(np.float32, copy=False)
+    jet_phi = ak.flatten(jets.phi).to_numpy().astype(np.float32, copy=False)
+    jet_mass = ak.flatten(jets.mass).to_numpy().astype(np.float32, copy=False)
+    jet_btag = ak.flatten(jets.btagCSVV2).to_numpy().astype(np.float32, copy=False)
+    jet_qgl = ak.flatten(jets.qgl).to_numpy().astype(np.float32, copy=False)
+
+    # exactly one lepton per event: the electron for events with an electron, the muon otherwise
+    has_electron = ak.to_numpy(ak.num(electrons)) == 1
+    lep_pt, lep_eta, lep_phi, lep_mass = (np.empty(len(has_electron), dtype=np.float32) for _ in range(4))
+    for lep_field, field in zip([lep_pt, lep_eta, lep_phi, lep_mass], ["pt", "eta", "phi", "mass"]):
+        lep_field[has_electron] = ak.flatten(electrons[field]).to_numpy()
+        lep_field[~has_electron] = ak.flatten(muons[field]).to_numpy()
+
+    # four-momenta of all jets and leptons
+    jet_px, jet_py, jet_pz, jet_e = _to_cartesian(jet_pt, jet_eta, jet_phi, jet_mass)
+    lep_px, lep_py, lep_pz, lep_e = _to_cartesian(lep_pt, lep_eta, lep_phi, lep_mass)
 
     #### calculate features ####
-    features = np.zeros((sum(perm_counts), 20))
-
-    # grab lepton info
-    leptons = ak.flatten(ak.concatenate((electrons, muons), axis=1), axis=-1)
-
-    # delta R between b_toplep and lepton
-    features[:, 0] = ak.flatten(np.sqrt((leptons.eta - jets[perms[..., 3]].eta) ** 2
-                                        + (leptons.phi - jets[perms[..., 3]].phi) ** 2)).to_numpy()
-
-    # delta R between the two W
-    features[:, 1] = ak.flatten(np.sqrt((jets[perms[..., 0]].eta - jets[perms[..., 1]].eta) ** 2
-                                        + (jets[perms[..., 0]].phi - jets[perms[..., 1]].phi) ** 2)).to_numpy()
-
-    # delta R between W and b_tophad
-    features[:, 2] = ak.flatten(np.sqrt((jets[perms[..., 0]].eta - jets[perms[..., 2]].eta) ** 2
-                                        + (jets[perms[..., 0]].phi - jets[perms[..., 2]].phi) ** 2)).to_numpy()
-    features[:, 3] = ak.flatten(np.sqrt((jets[perms[..., 1]].eta - jets[perms[..., 2]].eta) ** 2
-                                        + (jets[perms[..., 1]].phi - jets[perms[..., 2]].phi) ** 2)).to_numpy()
-
-    # combining the original leptons and jets arrays results in column overtouching
-    # see https://github.com/CoffeaTeam/coffea/issues/892 for details
-    # to work around this, create smaller versions of the arrays using only the relevant
-    # four-vector information
-    el_p4 = ak.zip({"pt": electrons.pt, "eta": electrons.eta, "phi": electrons.phi, "mass": electrons.mass}, with_name="Momentum4D")
-    mu_p4 = ak.zip({"pt": muons.pt, "eta": muons.eta, "phi": muons.phi, "mass": muons.mass}, with_name="Momentum4D")
-    lep_p4 = ak.flatten(ak.concatenate((el_p4, mu_p4), axis=1), axis=-1)
-    jet_p4 = ak.zip({"pt": jets.pt, "eta": jets.eta, "phi": jets.phi, "mass": jets.mass}, with_name="Momentum4D")
-
-    # combined mass of b_toplep and lepton
-    features[:, 4] = ak.flatten((lep_p4 + jet_p4[perms[..., 3]]).mass).to_numpy()
-
-    # combined mass of W
-    features[:, 5] = ak.flatten((jets[perms[..., 0]] + jets[perms[..., 1]]).mass).to_numpy()
-
-    # combined mass of W and b_tophad
-    features[:, 6] = ak.flatten((jets[perms[..., 0]] + jets[perms[..., 1]] + jets[perms[..., 2]]).mass).to_numpy()
-
-    # combined pT of W and b_tophad
-    features[:, 7] = ak.flatten((jets[perms[..., 0]] + jets[perms[..., 1]] + jets[perms[..., 2]]).pt).to_numpy()
-
-    # pt of every jet
-    features[:, 8] = ak.flatten(jets[perms[..., 0]].pt).to_numpy()
-    features[:, 9] = ak.flatten(jets[perms[..., 1]].pt).to_numpy()
-    features[:, 10] = ak.flatten(jets[perms[..., 2]].pt).to_numpy()
-    features[:, 11] = ak.flatten(jets[perms[..., 3]].pt).to_numpy()
-
-    # btagCSVV2 of every jet
-    features[:, 12] = ak.flatten(jets[perms[..., 0]].btagCSVV2).to_numpy()
-    features[:, 13] = ak.flatten(jets[perms[..., 1]].btagCSVV2).to_numpy()
-    features[:, 14] = ak.flatten(jets[perms[..., 2]].btagCSVV2).to_numpy()
-    features[:, 15] = ak.flatten(jets[perms[..., 3]].btagCSVV2).to_numpy()
-
-    # quark-gluon likelihood discriminator of every jet
-    features[:, 16] = ak.flatten(jets[perms[..., 0]].qgl).to_numpy()
-    features[:, 17] = ak.flatten(jets[perms[..., 1]].qgl).to_numpy()
-    features[:, 18] = ak.flatten(jets[perms[..., 2]].qgl).to_numpy()
-    features[:, 19] = ak.flatten(jets[perms[..., 3]].qgl).to_numpy()
+    # float32, as consumed by xgboost and Triton
+    features = np.zeros((len(perm_flat), 20), dtype=np.float32)
+    _fill_features(jet_pt, jet_eta, jet_phi, jet_px, jet_py, jet_pz, jet_e, jet_btag, jet_qgl,
+                   lep_eta, lep_phi, lep_px, lep_py, lep_pz, lep_e, perm_flat, perm_offsets, features)
 
     return features, perm_counts
 
 
 def get_inference_results_local(features, even, model_even, model_odd):
+    # predict directly with the boosters (no DMatrix construction or predict_proba post-processing),
+    # the binary:logistic objective already returns the probability of the positive class
     results = np.zeros(features.shape[0])
-    if len(features[even]) > 0:
-        results[even] = model_odd.predict_proba(features[even, :])[:, 1]
-    if len(features[np.invert(even)]) > 0:
-        results[np.invert(even)] = model_even.predict_proba(
-            features[np.invert(even), :]
-        )[:, 1]
+    even = np.asarray(even)
+    odd = np.invert(even)
+    if even.any():
+        results[even] = model_odd.get_booster().inplace_predict(features[even])
+    if odd.any():
+        results[odd] = model_even.get_booster().inplace_predict(features[odd])
     return results
 
 
 def get_inference_results_triton(features, even, triton_client, MODEL_NAME,
-                                 MODEL_VERS_EVEN, MODEL_VERS_ODD):
+                                 MODEL_VERS_EVEN, MODEL_VERS_ODD, model_io=None):
+    # model_io: (input name, input datatype, output name) of the model, requested from the server if not given
 
-    model_metadata = triton_client.get_model_metadata(MODEL_NAME, MODEL_VERS_EVEN)
-
-    input_name = model_metadata.inputs[0].name
-    dtype = model_metadata.inputs[0].datatype
-    output_name = model_metadata.outputs[0].name
+    if model_io is None:
+        model_metadata = triton_client.get_model_metadata(MODEL_NAME, MODEL_VERS_EVEN)
+        model_io = (model_metadata.inputs[0].name, model_metadata.inputs[0].datatype, model_metadata.outputs[0].name)
+    input_name, dtype, output_name = model_io
 
     results = np.zeros(features.shape[0])
+    features = features.astype(np.float32, copy=False)
+    even = np.asarray(even)
+    odd = np.invert(even)
 
     import tritonclient.grpc as grpcclient
 
     output = grpcclient.InferRequestedOutput(output_name)
 
-    if len(features[even]) > 0:
-        inpt = [grpcclient.InferInput(input_name, features[even].shape, dtype)]
-        inpt[0].set_data_from_numpy(features[even].astype(np.float32))
-        results[even] = triton_client.infer(
+    # send the requests for both models before waiting for any result, so that the server processes them concurrently
+    pending = []
+    for mask, model_version in ((even, MODEL_VERS_EVEN), (odd, MODEL_VERS_ODD)):
+        if not mask.any():
+            continue
+        features_masked = features[mask]
+        inpt = [grpcclient.InferInput(input_name, features_masked.shape, dtype)]
+        inpt[0].set_data_from_numpy(features_masked)
+        done = queue.SimpleQueue()
+        triton_client.async_infer(
             model_name=MODEL_NAME,
-            model_version=MODEL_VERS_EVEN,
             inputs=inpt,
+            callback=lambda result, error, done=done: done.put((result, error)),
+            model_version=model_version,
             outputs=[output],
-        ).as_numpy(output_name)[:, 1]
-    if len(features[np.invert(even)]) > 0:
-        inpt = [
-            grpcclient.InferInput(input_name, features[np.invert(even)].shape, dtype)
-        ]
-        inpt[0].set_data_from_numpy(features[np.invert(even)].astype(np.float32))
-        results[np.invert(even)] = triton_client.infer(
-            model_name=MODEL_NAME,
-            model_version=MODEL_VERS_ODD,
-            inputs=inpt,
-            outputs=[output],
-        ).as_numpy(output_name)[:, 1]
+        )
+        pending.append((mask, done))
+
+    for mask, done in pending:
+        result, error = done.get()
+        if error is not None:
+            raise error
+        results[mask] = result.as_numpy(output_name)[:, 1]
 
     return results
 
@@ -363,7 +461,8 @@ def write_triton_config(
     backend_name = "fil", 
     model_type = "xgboost", 
     max_batch_size = 50000000, 
-    predict_proba = "true"
+    predict_proba = "true",
+    max_queue_delay_microseconds = 1000
 ):
     n_out = 1
     if predict_proba=="true":
@@ -422,6 +521,8 @@ def write_triton_config(
             + "  }\n"
             + "]\n"
             + "version_policy: { all { }}\n"
-            + "dynamic_batching { }")
+            + "dynamic_batching {\n"
+            + f"  max_queue_delay_microseconds: {max_queue_delay_microseconds}\n"
+            + "}")
 
     
@@ -0,0 +1,54 @@
+import math
+
+import numba
+import numpy as np
+
+
+# functions working on flattened jet properties, delimited per event by offsets
+@numba.njit(parallel=True, fastmath=True, cache=True)
+def best_trijet_mass(offsets, pt, eta, phi, mass, btag, btag_threshold):
+    # mass of the trijet system with largest pT among all trijets containing at least one b-tagged jet,
+    # offsets delimit the jets of each event in the flattened jet properties (NaN if there is no such trijet)
+    n_events = len(offsets) - 1
+    trijet_mass = np.full(n_events, np.nan)
+
+    for i in numba.prange(n_events):
+        start, stop = offsets[i], offsets[i + 1]
+        best_pt2 = -1.0
+        for j1 in range(start, stop):
+            for j2 in range(j1 + 1, stop):
+                for j3 in range(j2 + 1, stop):
+                    if max(btag[j1], btag[j2], btag[j3]) <= btag_threshold:
+                        continue
+
+                    px = py = pz = e = 0.0
+                    for j in (j1, j2, j3):
+                        jet_px = pt[j] * math.cos(phi[j])
+                        jet_py = pt[j] * math.sin(phi[j])
+                        jet_pz = pt[j] * math.sinh(eta[j])
+                        px += jet_px
+                        py += jet_py
+                        pz += jet_pz
+                        e += math.sqrt(jet_px ** 2 + jet_py ** 2 + jet_pz ** 2 + mass[j] ** 2)
+
+                    # first candidate wins ties, same as ak.argmax
+                    pt2 = px ** 2 + py ** 2
+                    if pt2 > best_pt2:
+                        best_pt2 = pt2
+                        trijet_mass[i] = math.sqrt(max(e ** 2 - px ** 2 - py ** 2 - pz ** 2, 0.0))
+
+    return trijet_mass
+
+
+@numba.njit(parallel=True, cache=True)
+def count_btags(offsets, btag, btag_threshold):
+    # number of b-tagged jets per event in a single pass over the flattened b-tag scores
+    n_events = len(offsets) - 1
+    n_btag = np.zeros(n_events, dtype=np.int64)
+
+    for i in numba.prange(n_events):
+        for j in range(offsets[i], offsets[i + 1]):
+            if btag[j] > btag_threshold:
+                n_btag[i] += 1
+
+    return n_btag
@@ -4,7 +4,10 @@ import numpy as np
 # functions creating systematic variations
 def jet_pt_resolution(pt):
     # normal distribution with 5% variations, shape matches jets
-    counts = ak.num(pt)
-    pt_flat = ak.flatten(pt)
-    resolution_variation = np.random.normal(np.ones_like(pt_flat), 0.05)
-    return ak.unflatten(resolution_variation, counts)
\ No newline at end of file
+    # (a new generator seeded from the OS is used per call, so separate workers do not share random streams)
+    rng = np.random.default_rng()
+    counts = ak.num(pt).to_numpy()
+    resolution_variation = rng.standard_normal(counts.sum(), dtype=np.float32)
+    resolution_variation *= 0.05
+    resolution_variation += 1.0
+    return ak.unflatten(resolution_variation, counts)
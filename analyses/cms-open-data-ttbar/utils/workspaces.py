@@ -0,0 +1,34 @@
+import cabinetry
+import pyhf
+
+from .file_output import get_histogram_hash, is_up_to_date, save_hash
+from .rebinning import get_cabinetry_rebinning_router
+
+
+def build_workspace(config_path, workspace_path, rebinning=None, pruned_channels=None):
+    # build (and save) the workspace for a cabinetry configuration, optionally re-binning the histograms and pruning
+    # channels, or load the saved workspace if histograms, configuration, re-binning and pruning did not change since
+    # it was last built
+    config = cabinetry.configuration.load(config_path)
+    histogram_path = config["General"]["InputPath"].split(":")[0]
+
+    with open(config_path) as f:
+        ws_hash = get_histogram_hash(histogram_path, extra=f.read() + repr(rebinning) + repr(pruned_channels))
+
+    if is_up_to_date(workspace_path, ws_hash):
+        return cabinetry.workspace.load(workspace_path)
+
+    if rebinning is not None:
+        rebinning_router = get_cabinetry_rebinning_router(config, rebinning=rebinning)
+        cabinetry.templates.build(config, router=rebinning_router)
+    else:
+        cabinetry.templates.collect(config)
+    cabinetry.templates.postprocess(config)  # optional post-processing (e.g. smoothing)
+
+    ws = cabinetry.workspace.build(config)
+    if pruned_channels is not None:
+        ws = pyhf.Workspace(ws).prune(channels=pruned_channels)
+
+    cabinetry.workspace.save(ws, workspace_path)
+    save_hash(workspace_path, ws_hash)
+    return ws